@@ -0,0 +1,29 @@
+"""Add composite index for export history
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Serves the history query (filter by meter, newest first) from the index;
+    # its leading column also covers plain smart_meter_id lookups.
+    op.create_index(
+        'ix_jobs_smart_meter_created', 'jobs',
+        ['smart_meter_id', sa.text('created_at DESC')]
+    )
+    op.drop_index('ix_jobs_smart_meter_id', table_name='jobs')
+
+
+def downgrade() -> None:
+    op.create_index('ix_jobs_smart_meter_id', 'jobs', ['smart_meter_id'])
+    op.drop_index('ix_jobs_smart_meter_created', table_name='jobs')
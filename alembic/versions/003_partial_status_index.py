@@ -0,0 +1,29 @@
+"""Replace full status index with a partial index on active jobs
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Lookups by status only ever look for active jobs; completed and failed
+    # rows grow without bound and only bloat a full index.
+    op.create_index(
+        'ix_jobs_status_active', 'jobs', ['status'],
+        postgresql_where=sa.text("status IN ('pending', 'in_progress')")
+    )
+    op.drop_index('ix_jobs_status', table_name='jobs')
+
+
+def downgrade() -> None:
+    op.create_index('ix_jobs_status', 'jobs', ['status'])
+    op.drop_index('ix_jobs_status_active', table_name='jobs')
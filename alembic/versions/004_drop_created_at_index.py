@@ -0,0 +1,24 @@
+"""Drop created_at index now that job ids are time-ordered
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Job ids are UUIDv7, so the primary key already follows creation order,
+    # and the history query is served by ix_jobs_smart_meter_created.
+    op.drop_index('ix_jobs_created_at', table_name='jobs')
+
+
+def downgrade() -> None:
+    op.create_index('ix_jobs_created_at', 'jobs', ['created_at'])
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, desc
+from sqlalchemy import select, insert, update, and_, desc, func
+from redis import RedisError
 from uuid import UUID
 import os
+import time
+import logging
 from datetime import datetime, timezone
-from typing import Optional, Union
-from celery.result import AsyncResult
+from typing import Optional
 
-from ..core.database import get_db
+from ..core.database import get_db, async_session_maker
+from ..core.redis_client import get_redis, progress_key
 from ..models.job import Job, JobStatus, ExportFormat
 from ..schemas.job import (
     ExportRequest, ExportResponse, JobStatusResponse, 
@@ -18,29 +21,42 @@ from ..schemas.job import (
 )
 from ..tasks.export_tasks import process_export
 
-# Helper for tests
-async def execute_query(db: Union[AsyncSession, Session], query):
-    if isinstance(db, AsyncSession):
-        return await db.execute(query)
-    else:
-        return db.execute(query)
+logger = logging.getLogger(__name__)
 
-async def commit_db(db: Union[AsyncSession, Session]):
-    if isinstance(db, AsyncSession):
-        await db.commit()
-    else:
-        db.commit()
+router = APIRouter(prefix="/api/export", tags=["export"])
 
-async def refresh_obj(db: Union[AsyncSession, Session], obj):
-    if isinstance(db, AsyncSession):
-        await db.refresh(obj)
-    else:
-        db.refresh(obj)
+# Completed and failed jobs never change again, so their status responses
+# are kept briefly to absorb clients that poll the same job repeatedly.
+STATUS_CACHE_TTL_SECONDS = 1.0
+STATUS_CACHE_MAX_ENTRIES = 10000
+_status_cache: dict[UUID, tuple[float, JobStatusResponse]] = {}
 
-router = APIRouter(prefix="/api/export", tags=["export"])
+async def queue_export(job_id: str):
+    """Publish the export task, failing the job if the broker rejects it."""
+    try:
+        # Publishing is blocking network I/O; keep it off the event loop
+        await run_in_threadpool(process_export.apply_async, args=[job_id], ignore_result=True)
+    except Exception:
+        logger.exception("Failed to queue export job %s", job_id)
+        async with async_session_maker() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.id == job_id)
+                .values(
+                    status=JobStatus.FAILED,
+                    error_message="Export job could not be queued",
+                    error_code="QUEUE_FAILED",
+                    updated_at=datetime.now(timezone.utc),
+                )
+            )
+            await db.commit()
 
 @router.post("/csv", response_model=ExportResponse)
-async def create_export(request: ExportRequest, db: Union[AsyncSession, Session] = Depends(get_db)):
+async def create_export(
+    request: ExportRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
     start_dt = request.start_datetime
     end_dt = request.end_datetime
     
@@ -49,30 +65,43 @@ async def create_export(request: ExportRequest, db: Union[AsyncSession, Session]
     if end_dt.tzinfo is None:
         end_dt = end_dt.replace(tzinfo=timezone.utc)
     
-    job = Job(
-        smart_meter_id=request.smart_meter_id,
-        start_datetime=start_dt,
-        end_datetime=end_dt,
-        format=request.format or ExportFormat.CSV,
-        status=JobStatus.PENDING.value
+    result = await db.execute(
+        insert(Job)
+        .values(
+            smart_meter_id=request.smart_meter_id,
+            start_datetime=start_dt,
+            end_datetime=end_dt,
+            format=request.format or ExportFormat.CSV,
+            status=JobStatus.PENDING.value
+        )
+        .returning(Job.id)
     )
+    job_id = result.scalar_one()
+    await db.commit()
     
-    db.add(job)
-    await commit_db(db)
-    await refresh_obj(db, job)
-    
-    # Queue task
-    task = process_export.delay(str(job.id))
+    # Queue task after the response is sent; publishing to the broker blocks
+    background_tasks.add_task(queue_export, str(job_id))
     
     return ExportResponse(
-        job_id=str(job.id),
+        job_id=str(job_id),
         status=JobStatus.PENDING.value,
         message="Export job created successfully"
     )
 
 @router.get("/status/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: UUID, db: Union[AsyncSession, Session] = Depends(get_db)):
-    result = await execute_query(db, select(Job).where(Job.id == job_id))
+async def get_job_status(
+    job_id: UUID,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    redis=Depends(get_redis)
+):
+    response.headers["Cache-Control"] = "max-age=1"
+    
+    cached = _status_cache.get(job_id)
+    if cached and time.monotonic() - cached[0] < STATUS_CACHE_TTL_SECONDS:
+        return cached[1]
+    
+    result = await db.execute(select(Job).where(Job.id == job_id))
     job = result.scalar_one_or_none()
     
     if not job:
@@ -84,7 +113,7 @@ async def get_job_status(job_id: UUID, db: Union[AsyncSession, Session] = Depend
             ).model_dump()
         )
     
-    response = JobStatusResponse(
+    job_status = JobStatusResponse(
         job_id=job.id,
         status=job.status,
         message=get_status_message(job.status),
@@ -93,9 +122,15 @@ async def get_job_status(job_id: UUID, db: Union[AsyncSession, Session] = Depend
         progress_percentage=job.progress_percentage if job.status == JobStatus.IN_PROGRESS else None
     )
     
+    if job.status == JobStatus.IN_PROGRESS:
+        percentage, updated_at = await get_live_progress(redis, job.id)
+        if percentage is not None:
+            job_status.progress_percentage = int(percentage)
+            job_status.updated_at = datetime.fromisoformat(updated_at.decode())
+    
     if job.status == JobStatus.COMPLETED and job.file_path:
         filename = os.path.basename(job.file_path)
-        response.file_info = FileInfo(
+        job_status.file_info = FileInfo(
             filename=filename,
             download_url=f"/api/export/download/{job.id}",
             file_size_bytes=job.file_size_bytes,
@@ -107,17 +142,22 @@ async def get_job_status(job_id: UUID, db: Union[AsyncSession, Session] = Depend
         )
     
     elif job.status == JobStatus.FAILED and job.error_message:
-        response.error = ErrorInfo(
+        job_status.error = ErrorInfo(
             code=job.error_code or "EXPORT_FAILED",
             message=job.error_message,
             details=f"Export failed for smart meter {job.smart_meter_id}"
         )
     
-    return response
+    if job.status in (JobStatus.COMPLETED, JobStatus.FAILED):
+        if len(_status_cache) >= STATUS_CACHE_MAX_ENTRIES:
+            _status_cache.clear()
+        _status_cache[job_id] = (time.monotonic(), job_status)
+    
+    return job_status
 
 @router.get("/download/{job_id}")
-async def download_file(job_id: UUID, db: Union[AsyncSession, Session] = Depends(get_db)):
-    result = await execute_query(db, select(Job).where(Job.id == job_id))
+async def download_file(job_id: UUID, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Job).where(Job.id == job_id))
     job = result.scalar_one_or_none()
     
     if not job:
@@ -131,22 +171,14 @@ async def download_file(job_id: UUID, db: Union[AsyncSession, Session] = Depends
     
     filename = os.path.basename(job.file_path)
     
+    # FileResponse reads the file in 64 KiB chunks; .gz files are served as-is
+    # with Content-Encoding so clients receive the decompressed export.
     if job.file_path.endswith('.gz'):
-        def iterfile():
-            with open(job.file_path, 'rb') as f:
-                yield from f
-        
-        headers = {
-            'Content-Encoding': 'gzip',
-            'Content-Disposition': f'attachment; filename="{filename[:-3]}"'
-        }
-        
-        media_type = get_media_type(filename[:-3])
-        
-        return StreamingResponse(
-            iterfile(),
-            media_type=media_type,
-            headers=headers
+        return FileResponse(
+            job.file_path,
+            filename=filename[:-3],
+            media_type=get_media_type(filename[:-3]),
+            headers={'Content-Encoding': 'gzip'}
         )
     else:
         return FileResponse(
@@ -160,14 +192,14 @@ async def get_export_history(
     smart_meter_id: str,
     limit: int = 50,
     offset: int = 0,
-    db: Union[AsyncSession, Session] = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    count_result = await execute_query(db,
-        select(Job).where(Job.smart_meter_id == smart_meter_id)
+    count_result = await db.execute(
+        select(func.count()).select_from(Job).where(Job.smart_meter_id == smart_meter_id)
     )
-    total_count = len(count_result.scalars().all())
+    total_count = count_result.scalar_one()
     
-    result = await execute_query(db,
+    result = await db.execute(
         select(Job)
         .where(Job.smart_meter_id == smart_meter_id)
         .order_by(desc(Job.created_at))
@@ -209,21 +241,29 @@ async def get_export_history(
         exports=exports
     )
 
+async def get_live_progress(redis, job_id: UUID):
+    """Progress the worker reported to Redis, or (None, None) if unavailable."""
+    try:
+        return await redis.hmget(progress_key(job_id), "percentage", "updated_at")
+    except RedisError:
+        logger.warning("Could not read progress for job %s", job_id, exc_info=True)
+        return None, None
+
+STATUS_MESSAGES = {
+    JobStatus.PENDING: "Job is being processed",
+    JobStatus.IN_PROGRESS: "Job is being processed",
+    JobStatus.COMPLETED: "Export completed successfully",
+    JobStatus.FAILED: "Export failed"
+}
+
+MEDIA_TYPES = {
+    ".csv": "text/csv",
+    ".json": "application/json",
+    ".xml": "application/xml"
+}
+
 def get_status_message(status: JobStatus) -> str:
-    messages = {
-        JobStatus.PENDING: "Job is being processed",
-        JobStatus.IN_PROGRESS: "Job is being processed",
-        JobStatus.COMPLETED: "Export completed successfully",
-        JobStatus.FAILED: "Export failed"
-    }
-    return messages.get(status, "Unknown status")
+    return STATUS_MESSAGES.get(status, "Unknown status")
 
 def get_media_type(filename: str) -> str:
-    if filename.endswith('.csv'):
-        return 'text/csv'
-    elif filename.endswith('.json'):
-        return 'application/json'
-    elif filename.endswith('.xml'):
-        return 'application/xml'
-    else:
-        return 'application/octet-stream' 
\ No newline at end of file
+    return MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
@@ -15,4 +15,5 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     result_expires=3600,
+    task_ignore_result=True,
 ) 
\ No newline at end of file
@@ -4,7 +4,16 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-async_engine = create_async_engine(settings.database_url.replace("postgresql://", "postgresql+asyncpg://"))
+async_engine = create_async_engine(
+    settings.database_url.replace("postgresql://", "postgresql+asyncpg://"),
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+    # Server-side JIT only adds planning time to the short queries this API runs
+    connect_args={"server_settings": {"jit": "off"}, "statement_cache_size": 1024},
+)
 async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
 sync_engine = create_engine(settings.database_url)
@@ -14,11 +23,4 @@ Base = declarative_base()
 
 async def get_db():
     async with async_session_maker() as session:
-        yield session
-
-def get_sync_db():
-    db = sync_session_maker()
-    try:
-        yield db
-    finally:
-        db.close() 
\ No newline at end of file
+        yield session 
\ No newline at end of file
@@ -0,0 +1,16 @@
+import redis
+import redis.asyncio as aioredis
+from .config import settings
+
+# Live export progress is kept in Redis rather than on the jobs row, so the
+# worker does not UPDATE Postgres on every tick while clients poll it.
+PROGRESS_TTL_SECONDS = 3600
+
+redis_client = redis.from_url(settings.redis_url)
+async_redis_client = aioredis.from_url(settings.redis_url)
+
+def progress_key(job_id) -> str:
+    return f"job:{job_id}:progress"
+
+async def get_redis():
+    return async_redis_client
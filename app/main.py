@@ -1,11 +1,12 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
 import logging
 
 from .api import export
 from .core.database import async_engine
+from .core.redis_client import async_redis_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,9 +17,11 @@ async def lifespan(app: FastAPI):
     yield
     logger.info("Shutting down...")
     await async_engine.dispose()
+    await async_redis_client.aclose()
 
 app = FastAPI(
     title="Smart Meter Export API",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -26,15 +29,16 @@ app.include_router(export.router)
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    errors = []
-    for error in exc.errors():
-        errors.append({
-            "field": ".".join(str(loc) for loc in error["loc"]),
+    errors = [
+        {
+            "field": ".".join(map(str, error["loc"])),
             "message": error["msg"],
             "type": error["type"]
-        })
+        }
+        for error in exc.errors()
+    ]
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content={"detail": errors}
     )
@@ -2,12 +2,29 @@ from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Text, type
 from sqlalchemy import Enum as SQLEnum
 from sqlalchemy.dialects.postgresql import UUID as PostgresUUID
 from ..core.database import Base
+import os
+import time
 import uuid
 from datetime import datetime, timezone
 import enum
 
 UUID = PostgresUUID
 
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7) so new jobs append to the PK index."""
+    # 48 bits of Unix milliseconds, 12 bits of sub-millisecond time, 62 random bits
+    nanoseconds = time.time_ns()
+    milliseconds, remainder = divmod(nanoseconds, 1_000_000)
+    sub_millisecond = remainder * 4096 // 1_000_000
+    random_bits = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    
+    value = (milliseconds & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= sub_millisecond << 64
+    value |= 0b10 << 62
+    value |= random_bits
+    return uuid.UUID(int=value)
+
 class JobStatus(str, enum.Enum):
     PENDING = "pending"
     IN_PROGRESS = "in_progress"
@@ -34,7 +51,7 @@ ExportFormatEnum = SQLEnum(
 class Job(Base):
     __tablename__ = "jobs"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     smart_meter_id = Column(String, nullable=False)
     start_datetime = Column(DateTime(timezone=True), nullable=False)
     end_datetime = Column(DateTime(timezone=True), nullable=False)
@@ -1,9 +1,13 @@
 from pydantic import BaseModel, Field, field_validator
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict
 from uuid import UUID
 from ..models.job import JobStatus, ExportFormat
 
+UTC = timezone.utc
+MAX_RANGE_DAYS = 365
+MIN_RANGE = timedelta(minutes=1)
+
 class ExportRequest(BaseModel):
     smart_meter_id: str = Field(..., min_length=1, json_schema_extra={"example": "123"})
     start_datetime: datetime = Field(..., json_schema_extra={"example": "2025-07-01T00:00:00.000Z"})
@@ -12,30 +16,28 @@ class ExportRequest(BaseModel):
     
     @field_validator('start_datetime')
     def start_datetime_must_be_past(cls, v):
-        now = datetime.now(timezone.utc)
         if v.tzinfo is None:
-            v = v.replace(tzinfo=timezone.utc)
-        if v > now:
+            v = v.replace(tzinfo=UTC)
+        if v > datetime.now(UTC):
             raise ValueError('start_datetime must be in the past')
         return v
     
     @field_validator('end_datetime')
     def end_datetime_validation(cls, v, info):
+        # start_datetime has already been made timezone-aware by its validator
         if 'start_datetime' in info.data:
             start_dt = info.data['start_datetime']
             
             if v.tzinfo is None:
-                v = v.replace(tzinfo=timezone.utc)
-            if start_dt.tzinfo is None:
-                start_dt = start_dt.replace(tzinfo=timezone.utc)
+                v = v.replace(tzinfo=UTC)
             
             if v <= start_dt:
                 raise ValueError('end_datetime must be after start_datetime')
             
             date_range = v - start_dt
-            if date_range.days > 365:
-                raise ValueError('Date range cannot exceed 365 days')
-            if date_range.total_seconds() < 60:
+            if date_range.days > MAX_RANGE_DAYS:
+                raise ValueError(f'Date range cannot exceed {MAX_RANGE_DAYS} days')
+            if date_range < MIN_RANGE:
                 raise ValueError('Date range must be at least 1 minute')
         
         return v
@@ -1,6 +1,13 @@
-from datetime import datetime, timedelta
-import random
+from datetime import datetime, timedelta, timezone
 from typing import Generator, Dict, Any
+import numpy as np
+
+READING_FIELDS = (
+    "timestamp", "smart_meter_id", "energy_kwh", "power_kw", "voltage_v", "current_a"
+)
+
+# One week of 1-minute readings per batch
+ARRAY_BATCH_SIZE = 10080
 
 def generate_smart_meter_data(
     smart_meter_id: str,
@@ -9,39 +16,70 @@ def generate_smart_meter_data(
     interval_minutes: int = 1
 ) -> Generator[Dict[str, Any], None, None]:
     
+    for batch in generate_smart_meter_data_arrays(
+        smart_meter_id, start_datetime, end_datetime, interval_minutes
+    ):
+        columns = [batch[field].tolist() for field in READING_FIELDS]
+        for values in zip(*columns):
+            yield dict(zip(READING_FIELDS, values))
+
+def generate_smart_meter_data_arrays(
+    smart_meter_id: str,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    interval_minutes: int = 1,
+    batch_size: int = ARRAY_BATCH_SIZE
+) -> Generator[Dict[str, Any], None, None]:
+    """Same readings as generate_smart_meter_data, as column batches of NumPy arrays."""
+    
     base_voltage = 230.0
     base_power = 2.0
     
-    current_time = start_datetime
+    rng = np.random.default_rng()
+    total = count_smart_meter_readings(start_datetime, end_datetime, interval_minutes)
+    if start_datetime.tzinfo is not None:
+        start_datetime = start_datetime.astimezone(timezone.utc).replace(tzinfo=None)
+    start = np.datetime64(start_datetime, "ms")
+    interval = np.timedelta64(interval_minutes, "m")
     
-    while current_time <= end_datetime:
-        hour = current_time.hour
+    for offset in range(0, total, batch_size):
+        ticks = np.arange(offset, min(offset + batch_size, total))
+        n = len(ticks)
+        timestamps = start + ticks * interval
+        hours = timestamps.astype("datetime64[h]").astype(np.int64) % 24
         
-        # Peak hours (morning and evening)
-        if 6 <= hour <= 9 or 17 <= hour <= 22:
-            power_multiplier = random.uniform(1.5, 2.5)
-        # Night hours
-        elif 23 <= hour or hour <= 5:
-            power_multiplier = random.uniform(0.3, 0.8)
-        # Regular hours
-        else:
-            power_multiplier = random.uniform(0.8, 1.5)
+        # Peak hours (morning and evening), night hours, regular hours
+        peak = ((hours >= 6) & (hours <= 9)) | ((hours >= 17) & (hours <= 22))
+        night = (hours >= 23) | (hours <= 5)
+        multiplier_low = np.select([peak, night], [1.5, 0.3], 0.8)
+        multiplier_high = np.select([peak, night], [2.5, 0.8], 1.5)
         
-        power_kw = base_power * power_multiplier + random.uniform(-0.2, 0.2)
-        voltage_v = base_voltage + random.uniform(-5, 5)
+        # One draw per batch: multiplier, power noise, voltage noise
+        draws = rng.uniform(size=(n, 3))
+        power_multiplier = multiplier_low + (multiplier_high - multiplier_low) * draws[:, 0]
+        power_kw = base_power * power_multiplier + (draws[:, 1] * 0.4 - 0.2)
+        voltage_v = base_voltage + (draws[:, 2] * 10 - 5)
         current_a = (power_kw * 1000) / voltage_v
         energy_kwh = (power_kw * interval_minutes) / 60
         
         yield {
-            "timestamp": current_time.isoformat() + "Z",
-            "smart_meter_id": smart_meter_id,
-            "energy_kwh": round(energy_kwh, 3),
-            "power_kw": round(power_kw, 3),
-            "voltage_v": round(voltage_v, 1),
-            "current_a": round(current_a, 2)
+            "timestamp": np.char.add(np.datetime_as_string(timestamps, unit="ms"), "Z"),
+            "smart_meter_id": np.full(n, smart_meter_id),
+            "energy_kwh": np.round(energy_kwh, 3),
+            "power_kw": np.round(power_kw, 3),
+            "voltage_v": np.round(voltage_v, 1),
+            "current_a": np.round(current_a, 2)
         }
-        
-        current_time += timedelta(minutes=interval_minutes)
+
+def count_smart_meter_readings(
+    start_datetime: datetime,
+    end_datetime: datetime,
+    interval_minutes: int = 1
+) -> int:
+    """Number of readings generate_smart_meter_data yields for the range."""
+    if end_datetime < start_datetime:
+        return 0
+    return (end_datetime - start_datetime) // timedelta(minutes=interval_minutes) + 1
 
 def validate_smart_meter_id(smart_meter_id: str) -> bool:
 
@@ -1,152 +1,303 @@
 from celery import Task
+from redis import RedisError
+from sqlalchemy import select, update
 from ..celery_app import celery_app
 from ..core.database import sync_session_maker
+from ..core.redis_client import redis_client, progress_key, PROGRESS_TTL_SECONDS
 from ..models.job import Job, JobStatus
-from ..services.smart_meter_data import generate_smart_meter_data, validate_smart_meter_id
+from ..services.smart_meter_data import (
+    READING_FIELDS, generate_smart_meter_data_arrays,
+    count_smart_meter_readings, validate_smart_meter_id
+)
 from ..core.config import settings
 import csv
-import json
-import xml.etree.ElementTree as ET
-import xml.dom.minidom
+import orjson
+from xml.sax.saxutils import escape as xml_escape
+from itertools import starmap
+import io
 import os
-import gzip
-from datetime import datetime
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# Meter readings compress well; level 1 keeps most of the ratio of the
+# default level 9 at a fraction of the CPU cost.
+GZIP_COMPRESSLEVEL = 1
+EXPORT_WRITE_BUFFER_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+# Progress is only written when it moved by at least this many points
+# or this many seconds have passed since the last write.
+PROGRESS_MIN_STEP = 5
+PROGRESS_MIN_INTERVAL_SECONDS = 1.0
 
 class ExportTask(Task):
+    _last_pct = 0
+    _last_ts = 0.0
+
+    def before_start(self, task_id, args, kwargs):
+        self._last_pct = 0
+        self._last_ts = 0.0
+
     def update_progress(self, job_id: str, percentage: int):
-        with sync_session_maker() as db:
-            job = db.query(Job).filter(Job.id == job_id).first()
-            if job:
-                job.progress_percentage = percentage
-                job.updated_at = datetime.utcnow()
-                db.commit()
+        now = time.monotonic()
+        if (percentage - self._last_pct < PROGRESS_MIN_STEP
+                and now - self._last_ts < PROGRESS_MIN_INTERVAL_SECONDS):
+            return
+        
+        key = progress_key(job_id)
+        try:
+            with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={
+                    "percentage": percentage,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                })
+                pipe.expire(key, PROGRESS_TTL_SECONDS)
+                pipe.execute()
+        except RedisError:
+            # Progress is informational; never fail the export over it
+            logger.warning("Could not record progress for job %s", job_id, exc_info=True)
+        
+        self._last_pct = percentage
+        self._last_ts = now
+
+def _update_job(db, job_id: str, **values):
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(updated_at=datetime.now(timezone.utc), **values)
+    )
+    db.commit()
 
 @celery_app.task(bind=True, base=ExportTask)
 def process_export(self, job_id: str):
     with sync_session_maker() as db:
-        job = db.query(Job).filter(Job.id == job_id).first()
+        job = db.execute(
+            select(Job.smart_meter_id, Job.start_datetime, Job.end_datetime, Job.format)
+            .where(Job.id == job_id)
+        ).one_or_none()
         if not job:
             return
         
         try:
-            job.status = JobStatus.IN_PROGRESS
-            job.updated_at = datetime.utcnow()
-            db.commit()
+            _update_job(db, job_id, status=JobStatus.IN_PROGRESS)
             
             if not validate_smart_meter_id(job.smart_meter_id):
                 raise ValueError(f"Smart meter with ID '{job.smart_meter_id}' not found")
             
-            data = list(generate_smart_meter_data(
+            batches = generate_smart_meter_data_arrays(
                 job.smart_meter_id,
                 job.start_datetime,
                 job.end_datetime
-            ))
-            
-            total_records = len(data)
+            )
+            total_records = count_smart_meter_readings(job.start_datetime, job.end_datetime)
             
             date_format = "%Y%m%d"
             filename_base = f"smart_meter_{job.smart_meter_id}_{job.start_datetime.strftime(date_format)}_{job.end_datetime.strftime(date_format)}"
             
             if job.format == "csv":
-                file_path = export_to_csv(data, filename_base, job_id, self)
+                export_csv = export_to_csv_arrow if pa is not None else export_to_csv
+                file_path, record_count = export_csv(batches, total_records, filename_base, job_id, self)
             elif job.format == "json":
-                file_path = export_to_json(data, filename_base, job_id, self)
+                file_path, record_count = export_to_json(batches, total_records, filename_base, job_id, self)
             elif job.format == "xml":
-                file_path = export_to_xml(data, filename_base, job_id, self)
+                file_path, record_count = export_to_xml(batches, total_records, filename_base, job_id, self)
             else:
                 raise ValueError(f"Unsupported format: {job.format}")
             
             # Job success
-            file_size = os.path.getsize(file_path)
-            job.status = JobStatus.COMPLETED
-            job.file_path = file_path
-            job.record_count = total_records
-            job.file_size_bytes = file_size
-            job.progress_percentage = 100
-            job.updated_at = datetime.utcnow()
-            db.commit()
+            _update_job(
+                db, job_id,
+                status=JobStatus.COMPLETED,
+                file_path=file_path,
+                record_count=record_count,
+                file_size_bytes=os.path.getsize(file_path),
+                progress_percentage=100
+            )
             
         except Exception as e:
             # Job failure
-            job.status = JobStatus.FAILED
-            job.error_message = str(e)
-            job.updated_at = datetime.utcnow()
-            
             if "not found" in str(e).lower():
-                job.error_code = "SMART_METER_NOT_FOUND"
+                error_code = "SMART_METER_NOT_FOUND"
             else:
-                job.error_code = "EXPORT_FAILED"
+                error_code = "EXPORT_FAILED"
             
-            db.commit()
+            db.rollback()
+            _update_job(
+                db, job_id,
+                status=JobStatus.FAILED,
+                error_message=str(e),
+                error_code=error_code
+            )
             raise
 
-def export_to_csv(data, filename_base, job_id, task):
+@contextmanager
+def _gzip_writer(fileobj, mode):
+    with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=GZIP_COMPRESSLEVEL) as gz_file:
+        if 't' in mode:
+            with io.TextIOWrapper(gz_file, encoding='utf-8') as text_file:
+                yield text_file
+        else:
+            yield gz_file
+
+@contextmanager
+def open_export_file(path, mode='wt', fileobj=None):
+    """Gzip writer over a 1 MiB buffered file that is fsynced once on close.
+    
+    If fileobj is given the compressed stream goes there instead of path,
+    and fileobj is left open.
+    """
+    if fileobj is not None:
+        with _gzip_writer(fileobj, mode) as gz_file:
+            yield gz_file
+        return
+    with open(path, 'wb', buffering=EXPORT_WRITE_BUFFER_SIZE) as raw:
+        with _gzip_writer(raw, mode) as gz_file:
+            yield gz_file
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def _batch_rows(batch):
+    """Rows of a column batch as value tuples in READING_FIELDS order."""
+    return zip(*[batch[field].tolist() for field in READING_FIELDS])
+
+def export_to_csv(batches, total_records, filename_base, job_id, task, fileobj=None):
+    """Write column batches with the csv module; used when pyarrow is missing.
+    
+    Matches Arrow's dialect (quoted header and strings, bare numbers, LF line
+    endings) except for floats: repr() keeps a trailing ".0" on whole values
+    and pads exponents ("2.0", "1e-07") where Arrow writes "2" and "1e-7".
+    Both parse to the same values.
+    """
     file_path = os.path.join(settings.export_directory, f"{filename_base}.csv")
     gz_file_path = f"{file_path}.gz"
     
-    total_records = len(data)
+    total_records = max(total_records, 1)
+    record_count = 0
     
-    with gzip.open(gz_file_path, 'wt', encoding='utf-8') as gz_file:
-        if total_records > 0:
-            fieldnames = data[0].keys()
-            writer = csv.DictWriter(gz_file, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for idx, row in enumerate(data):
-                writer.writerow(row)
-                if idx % 100 == 0:
-                    progress = int((idx / total_records) * 90) + 10
-                    task.update_progress(job_id, progress)
+    with open_export_file(gz_file_path, 'wt', fileobj) as gz_file:
+        writer = csv.writer(gz_file, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+        writer.writerow(READING_FIELDS)
+        for batch in batches:
+            columns = [batch[field].tolist() for field in READING_FIELDS]
+            writer.writerows(zip(*columns))
+            record_count += len(columns[0])
+            progress = int((record_count / total_records) * 90) + 10
+            task.update_progress(job_id, progress)
+    
+    return gz_file_path, record_count
+
+def export_to_csv_arrow(batches, total_records, filename_base, job_id, task, fileobj=None):
+    """Write column batches with Arrow's C++ CSV writer."""
+    file_path = os.path.join(settings.export_directory, f"{filename_base}.csv")
+    gz_file_path = f"{file_path}.gz"
+    
+    schema = pa.schema([
+        ("timestamp", pa.string()),
+        ("smart_meter_id", pa.string()),
+        ("energy_kwh", pa.float64()),
+        ("power_kw", pa.float64()),
+        ("voltage_v", pa.float64()),
+        ("current_a", pa.float64())
+    ])
+    total_records = max(total_records, 1)
+    record_count = 0
+    
+    with open_export_file(gz_file_path, 'wb', fileobj) as gz_file:
+        with pa_csv.CSVWriter(gz_file, schema) as writer:
+            for batch in batches:
+                record_batch = pa.RecordBatch.from_pydict(batch, schema=schema)
+                writer.write_batch(record_batch)
+                record_count += record_batch.num_rows
+                progress = int((record_count / total_records) * 90) + 10
+                task.update_progress(job_id, progress)
     
-    return gz_file_path
+    return gz_file_path, record_count
 
-def export_to_json(data, filename_base, job_id, task):
+def export_to_json(batches, total_records, filename_base, job_id, task, fileobj=None):
     file_path = os.path.join(settings.export_directory, f"{filename_base}.json")
     gz_file_path = f"{file_path}.gz"
     
-    export_data = {
-        "metadata": {
-            "export_date": datetime.utcnow().isoformat() + "Z",
-            "total_records": len(data),
-            "format": "json"
-        },
-        "data": data
+    metadata = {
+        "export_date": datetime.utcnow().isoformat() + "Z",
+        "total_records": total_records,
+        "format": "json"
     }
     
-    with gzip.open(gz_file_path, 'wt', encoding='utf-8') as gz_file:
-        json.dump(export_data, gz_file, indent=2)
+    total_records = max(total_records, 1)
+    record_count = 0
+    
+    # orjson writes compact JSON; one reading per line keeps large files
+    # greppable, and each batch goes to the gzip stream in a single write.
+    with open_export_file(gz_file_path, 'wb', fileobj) as gz_file:
+        gz_file.write(b'{"metadata":' + orjson.dumps(metadata) + b',"data":[')
+        separator = b"\n  "
+        for batch in batches:
+            rows = [dict(zip(READING_FIELDS, values)) for values in _batch_rows(batch)]
+            if rows:
+                gz_file.write(separator + b",\n  ".join(map(orjson.dumps, rows)))
+                separator = b",\n  "
+            record_count += len(rows)
+            progress = int((record_count / total_records) * 90) + 10
+            task.update_progress(job_id, progress)
+        gz_file.write(b"\n]}\n")
     
     task.update_progress(job_id, 95)
-    return gz_file_path
+    return gz_file_path, record_count
+
+# One <reading> element, pretty-printed, with a slot per READING_FIELDS value.
+XML_READING_TEMPLATE = "\n    <reading>" + "".join(
+    f"\n      <{field}>{{}}</{field}>" for field in READING_FIELDS
+) + "\n    </reading>"
 
-def export_to_xml(data, filename_base, job_id, task):
+# String columns may need escaping; the float columns never do.
+XML_STRING_FIELDS = frozenset({"timestamp", "smart_meter_id"})
+
+def export_to_xml(batches, total_records, filename_base, job_id, task, fileobj=None):
     file_path = os.path.join(settings.export_directory, f"{filename_base}.xml")
     gz_file_path = f"{file_path}.gz"
     
-    root = ET.Element("smart_meter_export")
-    
-    metadata = ET.SubElement(root, "metadata")
-    ET.SubElement(metadata, "export_date").text = datetime.utcnow().isoformat() + "Z"
-    ET.SubElement(metadata, "total_records").text = str(len(data))
+    header = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        "<smart_meter_export>\n"
+        "  <metadata>\n"
+        f"    <export_date>{datetime.utcnow().isoformat()}Z</export_date>\n"
+        f"    <total_records>{total_records}</total_records>\n"
+        "  </metadata>\n"
+        "  <readings>"
+    )
+    total_records = max(total_records, 1)
+    record_count = 0
     
-    readings = ET.SubElement(root, "readings")
-    
-    total_records = len(data)
-    for idx, row in enumerate(data):
-        reading = ET.SubElement(readings, "reading")
-        for key, value in row.items():
-            ET.SubElement(reading, key).text = str(value)
-        
-        if idx % 100 == 0:
-            progress = int((idx / total_records) * 90) + 10
+    # Each batch is rendered to one string and written as UTF-8 bytes; no
+    # element objects are built and the document is never held in memory.
+    with open_export_file(gz_file_path, 'wb', fileobj) as gz_file:
+        gz_file.write(header.encode())
+        for batch in batches:
+            columns = [
+                map(xml_escape, batch[field].tolist()) if field in XML_STRING_FIELDS
+                else batch[field].tolist()
+                for field in READING_FIELDS
+            ]
+            readings = "".join(starmap(XML_READING_TEMPLATE.format, zip(*columns)))
+            gz_file.write(readings.encode())
+            record_count += len(batch[READING_FIELDS[0]])
+            progress = int((record_count / total_records) * 90) + 10
             task.update_progress(job_id, progress)
-    
-    xml_str = ET.tostring(root, encoding='unicode')
-    dom = xml.dom.minidom.parseString(xml_str)
-    pretty_xml = dom.toprettyxml(indent="  ")
-    
-    with gzip.open(gz_file_path, 'wt', encoding='utf-8') as gz_file:
-        gz_file.write(pretty_xml)
+        gz_file.write(b"\n  </readings>\n</smart_meter_export>\n")
     
     task.update_progress(job_id, 95)
-    return gz_file_path 
\ No newline at end of file
+    return gz_file_path, record_count
@@ -1,11 +1,14 @@
 import pytest
 import asyncio
+import os
 from typing import Generator, Any
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, types, String
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event, types, String
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import configure_mappers
 from sqlalchemy.pool import StaticPool
 import uuid
+from datetime import datetime, timezone
 
 import sqlalchemy.dialects.postgresql
 original_uuid = sqlalchemy.dialects.postgresql.UUID
@@ -38,39 +41,205 @@ class TestUUID(types.TypeDecorator):
 sqlalchemy.dialects.postgresql.UUID = TestUUID
 
 from app.core.database import Base, get_db
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.api.export import _status_cache
 from app.main import app
+from app.celery_app import celery_app
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# Each xdist worker is its own process with its own in-memory database; the
+# worker id names it so a failing worker's database is identifiable.
+XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "main")
+SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///file:memdb_{XDIST_WORKER}?mode=memory&cache=shared&uri=true"
 
-engine = create_engine(
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# pysqlite/aiosqlite defer BEGIN until the first DML statement, which turns the
+# first SAVEPOINT into the outermost transaction. Emit BEGIN ourselves so test
+# savepoints nest inside the per-test transaction that gets rolled back.
+@event.listens_for(engine.sync_engine, "connect")
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+@event.listens_for(engine.sync_engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+async def create_schema():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+async def drop_schema():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+async def begin_test_transaction():
+    connection = await engine.connect()
+    transaction = await connection.begin()
+    return connection, transaction
+
+async def end_test_transaction(connection, transaction):
+    await transaction.rollback()
+    await connection.close()
+
+class BlockingSession:
+    """Drives an AsyncSession from synchronous tests on the client's event loop."""
+
+    def __init__(self, session: AsyncSession, portal):
+        self._session = session
+        self._portal = portal
+
+    def add(self, instance):
+        self._session.add(instance)
+
+    def execute(self, statement, params=None):
+        return self._portal.call(self._session.execute, statement, params)
+
+    def commit(self):
+        self._portal.call(self._session.commit)
+
+    def rollback(self):
+        self._portal.call(self._session.rollback)
+
+    def close(self):
+        self._portal.call(self._session.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class FakeRedis:
+    """In-memory stand-in for the Redis clients progress is written to and read from.
+    
+    The worker writes through sync pipelines and the API reads with async
+    hmget; values are stored as bytes, as Redis returns them.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+
+    async def hmget(self, name, *keys):
+        values = self.hashes.get(name, {})
+        return [values.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def hset(self, name, mapping):
+        self._redis.hashes.setdefault(name, {}).update(
+            (key, str(value).encode()) for key, value in mapping.items()
+        )
+
+    def expire(self, name, seconds):
+        pass
+
+    def execute(self):
+        pass
+
+def pytest_configure(config):
+    # Resolve mapper configuration once instead of inside the first test
+    # that touches the ORM.
+    configure_mappers()
+    # Tasks run in-process when published; nothing ever reaches a broker
+    # or result backend. Task errors are not propagated to the publisher:
+    # the task records them on the job itself, as it would in a worker.
+    celery_app.conf.update(
+        task_always_eager=True,
+        task_eager_propagates=False,
+        task_store_eager_result=False,
+        broker_url="memory://",
+        result_backend="cache+memory://",
+    )
 
 @pytest.fixture(scope="function")
-def db_session():
-    Base.metadata.create_all(bind=engine)
-    session = TestingSessionLocal()
-    try:
-        yield session
-    finally:
-        session.close()
-        Base.metadata.drop_all(bind=engine)
+def now():
+    return datetime.now(timezone.utc)
 
 @pytest.fixture(scope="function")
-def client(db_session):
-    async def override_get_db():
-        yield db_session
-    
-    app.dependency_overrides[get_db] = override_get_db
+def fake_redis():
+    return FakeRedis()
+
+@pytest.fixture(scope="session")
+def app_client():
+    # One client for the whole run: app startup happens once, and its portal's
+    # event loop owns the StaticPool connection for schema setup, per-test
+    # transactions and every request.
     with TestClient(app) as test_client:
+        test_client.portal.call(create_schema)
         yield test_client
-    app.dependency_overrides.clear()
+        test_client.portal.call(drop_schema)
+
+@pytest.fixture(scope="function")
+def session_factory(app_client):
+    portal = app_client.portal
+    connection, transaction = portal.call(begin_test_transaction)
+    # Commits inside the app and the tests release savepoints; the outer
+    # transaction is rolled back so each test starts from an empty table.
+    yield async_sessionmaker(
+        bind=connection,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint",
+    )
+    portal.call(end_test_transaction, connection, transaction)
+
+@pytest.fixture(scope="function")
+def client(app_client, session_factory, fake_redis, monkeypatch, tmp_path):
+    # Every session shares the test connection and nests savepoints on it,
+    # so requests issued concurrently take turns holding a session.
+    session_lock = asyncio.Lock()
+
+    async def override_get_db():
+        async with session_lock, session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_redis] = lambda: fake_redis
+    # Sessions the API opens outside a request (after queueing fails)
+    monkeypatch.setattr("app.api.export.async_session_maker", session_factory)
+    # Eagerly run tasks use the test transaction, the fake Redis and a
+    # per-test export directory.
+    monkeypatch.setattr(
+        "app.tasks.export_tasks.sync_session_maker",
+        lambda: BlockingSession(session_factory(), app_client.portal),
+    )
+    monkeypatch.setattr("app.tasks.export_tasks.redis_client", fake_redis)
+    monkeypatch.setattr(
+        "app.tasks.export_tasks.settings",
+        settings.model_copy(update={"export_directory": str(tmp_path)}),
+    )
+    try:
+        yield app_client
+    finally:
+        app.dependency_overrides.clear()
+        _status_cache.clear()
+
+@pytest.fixture(scope="function")
+def db_session(client, session_factory):
+    session = BlockingSession(session_factory(), client.portal)
+    try:
+        yield session
+    finally:
+        session.close()
 
 @pytest.fixture(scope="session")
 def event_loop():
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
-    loop.close() 
\ No newline at end of file
+    loop.close()
\ No newline at end of file
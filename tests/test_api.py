@@ -1,11 +1,15 @@
-from fastapi.testclient import TestClient
-from datetime import datetime, timedelta, timezone
+import pytest
+from datetime import datetime, timedelta
 import uuid
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 import os
 import tempfile
 import gzip
+import asyncio
+import httpx
+from sqlalchemy import insert
 
+from app.main import app
 from app.models.job import Job, JobStatus
 
 def test_root(client):
@@ -20,125 +24,108 @@ def test_health(client):
     assert response.status_code == 200
     assert response.json() == {"status": "healthy"}
 
+def send_concurrently(client, requests):
+    """Send prepared requests at the same time on the client's event loop."""
+    async def send_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url=client.base_url) as async_client:
+            return await asyncio.gather(*map(async_client.send, requests))
+    
+    return client.portal.call(send_all)
+
 class TestHappyPath:
     """Test 1: Happy path - Successful CSV export"""
     
-    def test_successful_csv_export(self, client):
+    @pytest.mark.parametrize("fmt,start_offset,end_offset", [
+        ("csv", timedelta(days=7), timedelta(days=6)),
+        ("json", timedelta(hours=2), timedelta(hours=1)),
+        ("xml", timedelta(minutes=10), timedelta(minutes=5)),
+    ])
+    def test_successful_export(self, client, now, fmt, start_offset, end_offset):
         export_data = {
             "smart_meter_id": "123",
-            "start_datetime": (datetime.now(timezone.utc) - timedelta(days=7)).isoformat(),
-            "end_datetime": (datetime.now(timezone.utc) - timedelta(days=6)).isoformat(),
-            "format": "csv"
+            "start_datetime": (now - start_offset).isoformat(),
+            "end_datetime": (now - end_offset).isoformat(),
+            "format": fmt
         }
         
-        with patch('app.api.export.process_export.delay') as mock_task:
-            response = client.post("/api/export/csv", json=export_data)
+        response = client.post("/api/export/csv", json=export_data)
         
         assert response.status_code == 200
         data = response.json()
         assert "job_id" in data
         assert data["status"] == "pending"
         assert data["message"] == "Export job created successfully"
-        assert mock_task.called
+        
+        # Celery runs eagerly in tests, so the task has finished by the time
+        # the request returns
+        status = client.get(f"/api/export/status/{data['job_id']}").json()
+        assert status["status"] == "completed"
+        assert status["file_info"]["record_count"] > 0
+        
+        download = client.get(status["file_info"]["download_url"])
+        assert download.status_code == 200
+        assert download.headers["content-disposition"].endswith(f'.{fmt}"')
     
-    def test_successful_json_export(self, client):
+    def test_unknown_smart_meter_fails_job(self, client, now):
         export_data = {
-            "smart_meter_id": "456",
-            "start_datetime": (datetime.now(timezone.utc) - timedelta(hours=2)).isoformat(),
-            "end_datetime": (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat(),
-            "format": "json"
+            "smart_meter_id": "abc",
+            "start_datetime": (now - timedelta(days=7)).isoformat(),
+            "end_datetime": (now - timedelta(days=6)).isoformat(),
+            "format": "csv"
         }
         
-        with patch('app.api.export.process_export.delay'):
-            response = client.post("/api/export/csv", json=export_data)
+        response = client.post("/api/export/csv", json=export_data)
         
         assert response.status_code == 200
-        assert response.json()["status"] == "pending"
+        status = client.get(f"/api/export/status/{response.json()['job_id']}").json()
+        assert status["status"] == "failed"
+        assert status["error"]["code"] == "SMART_METER_NOT_FOUND"
     
-    def test_successful_xml_export(self, client):
+    def test_queue_failure_marks_job_failed(self, client, now):
         export_data = {
-            "smart_meter_id": "789",
-            "start_datetime": (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat(),
-            "end_datetime": (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat(),
-            "format": "xml"
+            "smart_meter_id": "123",
+            "start_datetime": (now - timedelta(days=7)).isoformat(),
+            "end_datetime": (now - timedelta(days=6)).isoformat(),
+            "format": "csv"
         }
         
-        with patch('app.api.export.process_export.delay'):
+        with patch('app.api.export.process_export.apply_async', side_effect=ConnectionError("broker down")):
             response = client.post("/api/export/csv", json=export_data)
         
         assert response.status_code == 200
-        assert response.json()["status"] == "pending"
+        status = client.get(f"/api/export/status/{response.json()['job_id']}").json()
+        assert status["status"] == "failed"
+        assert status["error"]["code"] == "QUEUE_FAILED"
 
 class TestErrorCases:
     """Test 2: Error cases - Invalid inputs, missing data"""
     
-    def test_missing_required_fields(self, client):
-        response = client.post("/api/export/csv", json={})
-        assert response.status_code == 422
-        
-    def test_missing_smart_meter_id(self, client):
-        response = client.post("/api/export/csv", json={
-            "start_datetime": datetime.now(timezone.utc).isoformat(),
-            "end_datetime": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
-        })
+    @pytest.mark.parametrize("payload", [
+        {},
+        {"start_datetime": "2024-01-01T00:00:00Z", "end_datetime": "2024-01-01T01:00:00Z"},
+        {"smart_meter_id": "", "start_datetime": "2024-01-01T00:00:00Z", "end_datetime": "2024-01-02T00:00:00Z"},
+        {"smart_meter_id": "123", "start_datetime": "2024-01-01", "end_datetime": "2024-01-02"},
+    ], ids=["missing_required_fields", "missing_smart_meter_id", "empty_smart_meter_id", "invalid_datetime_format"])
+    def test_invalid_payload(self, client, payload):
+        response = client.post("/api/export/csv", json=payload)
         assert response.status_code == 422
     
-    def test_empty_smart_meter_id(self, client):
-        response = client.post("/api/export/csv", json={
-            "smart_meter_id": "",
-            "start_datetime": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat(),
-            "end_datetime": datetime.now(timezone.utc).isoformat()
-        })
-        assert response.status_code == 422
-    
-    def test_start_datetime_in_future(self, client):
+    @pytest.mark.parametrize("start_offset,end_offset,expected_message", [
+        (timedelta(days=-1), timedelta(days=-2), "start_datetime must be in the past"),
+        (timedelta(0), timedelta(days=1), "end_datetime must be after start_datetime"),
+        (timedelta(days=400), timedelta(0), "Date range cannot exceed 365 days"),
+        (timedelta(seconds=30), timedelta(0), "Date range must be at least 1 minute"),
+    ], ids=["start_datetime_in_future", "end_before_start", "date_range_too_large", "date_range_too_small"])
+    def test_invalid_date_range(self, client, now, start_offset, end_offset, expected_message):
         response = client.post("/api/export/csv", json={
             "smart_meter_id": "123",
-            "start_datetime": (datetime.now(timezone.utc) + timedelta(days=1)).isoformat(),
-            "end_datetime": (datetime.now(timezone.utc) + timedelta(days=2)).isoformat()
+            "start_datetime": (now - start_offset).isoformat(),
+            "end_datetime": (now - end_offset).isoformat()
         })
         assert response.status_code == 422
         errors = response.json()["detail"]
-        assert any("start_datetime must be in the past" in str(error) for error in errors)
-    
-    def test_end_before_start(self, client):
-        response = client.post("/api/export/csv", json={
-            "smart_meter_id": "123",
-            "start_datetime": datetime.now(timezone.utc).isoformat(),
-            "end_datetime": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
-        })
-        assert response.status_code == 422
-        errors = response.json()["detail"]
-        assert any("end_datetime must be after start_datetime" in str(error) for error in errors)
-    
-    def test_date_range_too_large(self, client):
-        response = client.post("/api/export/csv", json={
-            "smart_meter_id": "123",
-            "start_datetime": (datetime.now(timezone.utc) - timedelta(days=400)).isoformat(),
-            "end_datetime": datetime.now(timezone.utc).isoformat()
-        })
-        assert response.status_code == 422
-        errors = response.json()["detail"]
-        assert any("Date range cannot exceed 365 days" in str(error) for error in errors)
-    
-    def test_date_range_too_small(self, client):
-        now = datetime.now(timezone.utc)
-        response = client.post("/api/export/csv", json={
-            "smart_meter_id": "123",
-            "start_datetime": now.isoformat(),
-            "end_datetime": (now + timedelta(seconds=30)).isoformat()
-        })
-        assert response.status_code == 422
-        errors = response.json()["detail"]
-        assert any("Date range must be at least 1 minute" in str(error) for error in errors)
-    
-    def test_invalid_datetime_format(self, client):
-        response = client.post("/api/export/csv", json={
-            "smart_meter_id": "123",
-            "start_datetime": "2024-01-01",
-            "end_datetime": "2024-01-02"
-        })
-        assert response.status_code == 422
+        assert any(error["message"].endswith(expected_message) for error in errors)
     
     def test_job_not_found(self, client):
         fake_id = str(uuid.uuid4())
@@ -149,11 +136,11 @@ class TestErrorCases:
 class TestJobLifecycle:
     """Test 3: Job lifecycle - Pending → Completed/Failed"""
     
-    def test_job_status_pending(self, client, db_session):
+    def test_job_status_pending(self, client, db_session, now):
         job = Job(
             smart_meter_id="123",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
             status=JobStatus.PENDING
         )
         db_session.add(job)
@@ -167,11 +154,11 @@ class TestJobLifecycle:
         assert data["file_info"] is None
         assert data["error"] is None
     
-    def test_job_status_in_progress(self, client, db_session):
+    def test_job_status_in_progress(self, client, db_session, now):
         job = Job(
             smart_meter_id="123",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
             status=JobStatus.IN_PROGRESS,
             progress_percentage=45
         )
@@ -184,11 +171,33 @@ class TestJobLifecycle:
         assert data["status"] == "in_progress"
         assert data["progress_percentage"] == 45
     
-    def test_job_status_completed(self, client, db_session):
+    def test_job_status_in_progress_reads_live_progress(self, client, db_session, fake_redis, now):
         job = Job(
             smart_meter_id="123",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
+            status=JobStatus.IN_PROGRESS,
+            progress_percentage=0
+        )
+        db_session.add(job)
+        db_session.commit()
+        
+        fake_redis.hashes[f"job:{job.id}:progress"] = {
+            "percentage": b"72",
+            "updated_at": now.isoformat().encode()
+        }
+        
+        response = client.get(f"/api/export/status/{job.id}")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["progress_percentage"] == 72
+        assert datetime.fromisoformat(data["updated_at"]) == now
+    
+    def test_job_status_completed(self, client, db_session, now):
+        job = Job(
+            smart_meter_id="123",
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
             status=JobStatus.COMPLETED,
             file_path="/app/exports/test_file.csv.gz",
             file_size_bytes=1024,
@@ -208,11 +217,11 @@ class TestJobLifecycle:
         assert data["file_info"]["record_count"] == 100
         assert f"/api/export/download/{job.id}" in data["file_info"]["download_url"]
     
-    def test_job_status_failed(self, client, db_session):
+    def test_job_status_failed(self, client, db_session, now):
         job = Job(
             smart_meter_id="999",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
             status=JobStatus.FAILED,
             error_message="Smart meter with ID '999' not found",
             error_code="SMART_METER_NOT_FOUND"
@@ -228,10 +237,54 @@ class TestJobLifecycle:
         assert data["error"]["code"] == "SMART_METER_NOT_FOUND"
         assert "999" in data["error"]["message"]
 
+class TestStatusCache:
+    def test_terminal_status_is_cached(self, client, db_session, now):
+        job = Job(
+            smart_meter_id="123",
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
+            status=JobStatus.COMPLETED,
+            file_path="/app/exports/test_file.csv.gz",
+            file_size_bytes=1024,
+            record_count=100
+        )
+        db_session.add(job)
+        db_session.commit()
+        
+        response = client.get(f"/api/export/status/{job.id}")
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "max-age=1"
+        
+        job.record_count = 200
+        db_session.commit()
+        
+        response = client.get(f"/api/export/status/{job.id}")
+        assert response.json()["file_info"]["record_count"] == 100
+    
+    def test_in_progress_status_is_not_cached(self, client, db_session, now):
+        job = Job(
+            smart_meter_id="123",
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
+            status=JobStatus.IN_PROGRESS,
+            progress_percentage=10
+        )
+        db_session.add(job)
+        db_session.commit()
+        
+        response = client.get(f"/api/export/status/{job.id}")
+        assert response.json()["progress_percentage"] == 10
+        
+        job.progress_percentage = 60
+        db_session.commit()
+        
+        response = client.get(f"/api/export/status/{job.id}")
+        assert response.json()["progress_percentage"] == 60
+
 class TestFileDownload:
     """Test 4: File download - Correct file generation and download"""
     
-    def test_download_completed_file(self, client, db_session):
+    def test_download_completed_file(self, client, db_session, now):
         # Create a temporary file
         with tempfile.NamedTemporaryFile(mode='wb', suffix='.csv.gz', delete=False) as tmp:
             with gzip.open(tmp.name, 'wt', encoding='utf-8') as gz_file:
@@ -240,8 +293,8 @@ class TestFileDownload:
             
             job = Job(
                 smart_meter_id="123",
-                start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-                end_datetime=datetime.now(timezone.utc),
+                start_datetime=now - timedelta(days=1),
+                end_datetime=now,
                 status=JobStatus.COMPLETED,
                 file_path=tmp.name,
                 file_size_bytes=os.path.getsize(tmp.name),
@@ -254,6 +307,9 @@ class TestFileDownload:
             assert response.status_code == 200
             assert response.headers["content-encoding"] == "gzip"
             assert "attachment" in response.headers["content-disposition"]
+            assert os.path.basename(tmp.name)[:-3] in response.headers["content-disposition"]
+            assert response.headers["content-type"].startswith("text/csv")
+            assert response.text.startswith("timestamp,smart_meter_id,energy_kwh")
             
             os.unlink(tmp.name)
     
@@ -263,11 +319,11 @@ class TestFileDownload:
         assert response.status_code == 404
         assert "Job not found" in response.json()["detail"]
     
-    def test_download_pending_job(self, client, db_session):
+    def test_download_pending_job(self, client, db_session, now):
         job = Job(
             smart_meter_id="123",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
             status=JobStatus.PENDING
         )
         db_session.add(job)
@@ -277,11 +333,11 @@ class TestFileDownload:
         assert response.status_code == 400
         assert "Export not ready or failed" in response.json()["detail"]
     
-    def test_download_failed_job(self, client, db_session):
+    def test_download_failed_job(self, client, db_session, now):
         job = Job(
             smart_meter_id="123",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
+            start_datetime=now - timedelta(days=1),
+            end_datetime=now,
             status=JobStatus.FAILED,
             error_message="Export failed"
         )
@@ -295,19 +351,22 @@ class TestFileDownload:
 class TestConcurrentRequests:
     """Test 5: Concurrent requests - Multiple simultaneous exports"""
     
-    def test_multiple_export_requests(self, client):
+    def test_multiple_export_requests(self, client, now):
         job_ids = []
         
-        with patch('app.api.export.process_export.delay') as mock_task:
-            # Create multiple export requests
-            for i in range(5):
-                export_data = {
-                    "smart_meter_id": f"meter_{i}",
-                    "start_datetime": (datetime.now(timezone.utc) - timedelta(days=i+1)).isoformat(),
-                    "end_datetime": (datetime.now(timezone.utc) - timedelta(days=i)).isoformat(),
-                    "format": "csv"
-                }
-                response = client.post("/api/export/csv", json=export_data)
+        requests = [
+            client.build_request("POST", "/api/export/csv", json={
+                "smart_meter_id": f"meter_{i}",
+                "start_datetime": (now - timedelta(days=i+1)).isoformat(),
+                "end_datetime": (now - timedelta(days=i)).isoformat(),
+                "format": "csv"
+            })
+            for i in range(5)
+        ]
+        
+        with patch('app.api.export.process_export.apply_async') as mock_task:
+            # Create multiple export requests at once
+            for response in send_concurrently(client, requests):
                 assert response.status_code == 200
                 job_ids.append(response.json()["job_id"])
             
@@ -317,13 +376,30 @@ class TestConcurrentRequests:
         # Verify unique
         assert len(set(job_ids)) == 5
     
-    def test_concurrent_status_checks(self, client, db_session):
+    def test_job_ids_are_time_ordered(self, client, now):
+        export_data = {
+            "smart_meter_id": "123",
+            "start_datetime": (now - timedelta(days=1)).isoformat(),
+            "end_datetime": now.isoformat(),
+            "format": "csv"
+        }
+        
+        job_ids = [
+            uuid.UUID(client.post("/api/export/csv", json=export_data).json()["job_id"])
+            for _ in range(5)
+        ]
+        
+        assert all(job_id.version == 7 for job_id in job_ids)
+        assert job_ids == sorted(job_ids)
+        assert len(set(job_ids)) == 5
+    
+    def test_concurrent_status_checks(self, client, db_session, now):
         jobs = []
         for i in range(3):
             job = Job(
                 smart_meter_id=f"meter_{i}",
-                start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-                end_datetime=datetime.now(timezone.utc),
+                start_datetime=now - timedelta(days=1),
+                end_datetime=now,
                 status=JobStatus.PENDING if i == 0 else JobStatus.COMPLETED if i == 1 else JobStatus.IN_PROGRESS,
                 progress_percentage=50 if i == 2 else None
             )
@@ -331,8 +407,10 @@ class TestConcurrentRequests:
             jobs.append(job)
         db_session.commit()
         
-        for i, job in enumerate(jobs):
-            response = client.get(f"/api/export/status/{job.id}")
+        responses = send_concurrently(client, [
+            client.build_request("GET", f"/api/export/status/{job.id}") for job in jobs
+        ])
+        for i, response in enumerate(responses):
             assert response.status_code == 200
             data = response.json()
             if i == 0:
@@ -346,29 +424,30 @@ class TestConcurrentRequests:
 class TestExportHistory:
     """Bonus feature test: Export history"""
     
-    def test_export_history(self, client, db_session):
+    def test_export_history(self, client, db_session, now):
         smart_meter_id = "meter_123"
         
-        for i in range(3):
-            job = Job(
-                smart_meter_id=smart_meter_id,
-                start_datetime=datetime.now(timezone.utc) - timedelta(days=i+2),
-                end_datetime=datetime.now(timezone.utc) - timedelta(days=i+1),
-                status=JobStatus.COMPLETED,
-                file_path=f"/app/exports/export_{i}.csv.gz",
-                file_size_bytes=1024 * (i + 1),
-                record_count=100 * (i + 1)
-            )
-            db_session.add(job)
-        
+        rows = [
+            {
+                "smart_meter_id": smart_meter_id,
+                "start_datetime": now - timedelta(days=i+2),
+                "end_datetime": now - timedelta(days=i+1),
+                "status": JobStatus.COMPLETED,
+                "file_path": f"/app/exports/export_{i}.csv.gz",
+                "file_size_bytes": 1024 * (i + 1),
+                "record_count": 100 * (i + 1),
+                "created_at": now - timedelta(minutes=3 - i)
+            }
+            for i in range(3)
+        ]
         # Add one for different meter
-        other_job = Job(
-            smart_meter_id="other_meter",
-            start_datetime=datetime.now(timezone.utc) - timedelta(days=1),
-            end_datetime=datetime.now(timezone.utc),
-            status=JobStatus.COMPLETED
-        )
-        db_session.add(other_job)
+        rows.append({
+            "smart_meter_id": "other_meter",
+            "start_datetime": now - timedelta(days=1),
+            "end_datetime": now,
+            "status": JobStatus.COMPLETED
+        })
+        db_session.execute(insert(Job), rows)
         db_session.commit()
         
         response = client.get(f"/api/export/history/{smart_meter_id}")
@@ -384,17 +463,20 @@ class TestExportHistory:
             assert export["status"] == "completed"
             assert export["file_info"]["file_size_bytes"] == 1024 * (3 - i)
     
-    def test_export_history_pagination(self, client, db_session):
+    def test_export_history_pagination(self, client, db_session, now):
         smart_meter_id = "meter_456"
         
-        for i in range(10):
-            job = Job(
-                smart_meter_id=smart_meter_id,
-                start_datetime=datetime.now(timezone.utc) - timedelta(days=i+2),
-                end_datetime=datetime.now(timezone.utc) - timedelta(days=i+1),
-                status=JobStatus.COMPLETED
-            )
-            db_session.add(job)
+        base = now - timedelta(days=2)
+        
+        db_session.execute(insert(Job), [
+            {
+                "smart_meter_id": smart_meter_id,
+                "start_datetime": base - timedelta(days=i),
+                "end_datetime": base - timedelta(days=i-1),
+                "status": JobStatus.COMPLETED
+            }
+            for i in range(10)
+        ])
         db_session.commit()
         
         response = client.get(f"/api/export/history/{smart_meter_id}?limit=5&offset=0")
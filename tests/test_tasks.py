@@ -1,20 +1,34 @@
 import pytest
-import os
 import gzip
 import csv
 import json
-import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
-import tempfile
+from types import SimpleNamespace
+import io
+import numpy as np
+from redis import RedisError
 
-from app.tasks.export_tasks import export_to_csv, export_to_json, export_to_xml
+from app.tasks.export_tasks import export_to_csv, export_to_csv_arrow, export_to_json, export_to_xml
 from app.tasks.export_tasks import process_export as process_export_task
-from app.models.job import Job, JobStatus
-from app.services.smart_meter_data import generate_smart_meter_data, validate_smart_meter_id
+from app.tasks.export_tasks import ExportTask, open_export_file
+from app.tasks.export_tasks import gzip as export_gzip, pa as export_pa
+from app.models.job import JobStatus
+from app.services.smart_meter_data import (
+    READING_FIELDS, generate_smart_meter_data, generate_smart_meter_data_arrays,
+    count_smart_meter_readings, validate_smart_meter_id
+)
 
 process_export_func = process_export_task.__wrapped__.__func__
 
+def stub_task():
+    """Stand-in for the bound task where progress updates aren't asserted on."""
+    return SimpleNamespace(update_progress=lambda job_id, percentage: None)
+
+def gunzip(buffer):
+    """Decompressed text of an export written to an in-memory buffer."""
+    return gzip.decompress(buffer.getvalue()).decode("utf-8")
+
 class TestSmartMeterDataService:
     def test_validate_smart_meter_id_valid(self):
         assert validate_smart_meter_id("123") == True
@@ -27,9 +41,9 @@ class TestSmartMeterDataService:
         assert validate_smart_meter_id("") == False
         assert validate_smart_meter_id("meter123") == False
     
-    def test_generate_smart_meter_data(self):
-        start = datetime.now(timezone.utc) - timedelta(hours=1)
-        end = datetime.now(timezone.utc)
+    def test_generate_smart_meter_data(self, now):
+        start = now - timedelta(hours=1)
+        end = now
         
         data = list(generate_smart_meter_data("123", start, end, interval_minutes=30))
         
@@ -44,6 +58,32 @@ class TestSmartMeterDataService:
             assert "current_a" in record
             assert record["power_kw"] > 0
             assert 225 <= record["voltage_v"] <= 235
+    
+    def test_generate_smart_meter_data_arrays(self):
+        start = datetime(2024, 1, 1, 5, 30, tzinfo=timezone.utc)
+        end = start + timedelta(hours=1)
+        
+        batches = list(generate_smart_meter_data_arrays("123", start, end, batch_size=25))
+        
+        assert [len(batch["timestamp"]) for batch in batches] == [25, 25, 11]
+        assert batches[0]["timestamp"][0] == "2024-01-01T05:30:00.000Z"
+        assert batches[-1]["timestamp"][-1] == "2024-01-01T06:30:00.000Z"
+        for batch in batches:
+            assert set(batch) == {
+                "timestamp", "smart_meter_id", "energy_kwh", "power_kw", "voltage_v", "current_a"
+            }
+            assert (batch["smart_meter_id"] == "123").all()
+            assert (batch["power_kw"] > 0).all()
+            assert ((batch["voltage_v"] >= 225) & (batch["voltage_v"] <= 235)).all()
+    
+    def test_count_smart_meter_readings(self):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        end = start + timedelta(hours=1, seconds=30)
+        
+        assert count_smart_meter_readings(start, end) == 61
+        assert count_smart_meter_readings(start, end, interval_minutes=30) == 3
+        assert count_smart_meter_readings(end, start) == 0
+        assert count_smart_meter_readings(start, end) == len(list(generate_smart_meter_data("123", start, end)))
 
 class TestExportFunctions:
     @pytest.fixture
@@ -67,66 +107,189 @@ class TestExportFunctions:
             }
         ]
     
-    def test_export_to_csv(self, sample_data):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            with patch('app.tasks.export_tasks.settings') as mock_settings:
-                mock_settings.export_directory = tmpdir
-                
-                mock_task = MagicMock()
-                mock_task.update_progress = MagicMock()
-                
-                file_path = export_to_csv(sample_data, "test_export", "job123", mock_task)
-                
-                assert file_path.endswith(".csv.gz")
-                assert os.path.exists(file_path)
-                
-                with gzip.open(file_path, 'rt') as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-                    assert len(rows) == 2
-                    assert rows[0]["smart_meter_id"] == "123"
-                    assert float(rows[0]["energy_kwh"]) == 0.5
-    
-    def test_export_to_json(self, sample_data):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            with patch('app.tasks.export_tasks.settings') as mock_settings:
-                mock_settings.export_directory = tmpdir
-                
-                mock_task = MagicMock()
-                mock_task.update_progress = MagicMock()
-                
-                file_path = export_to_json(sample_data, "test_export", "job123", mock_task)
-                
-                assert file_path.endswith(".json.gz")
-                assert os.path.exists(file_path)
-                
-                with gzip.open(file_path, 'rt') as f:
-                    data = json.load(f)
-                    assert "metadata" in data
-                    assert data["metadata"]["total_records"] == 2
-                    assert "data" in data
-                    assert len(data["data"]) == 2
-    
-    def test_export_to_xml(self, sample_data):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            with patch('app.tasks.export_tasks.settings') as mock_settings:
-                mock_settings.export_directory = tmpdir
-                
-                mock_task = MagicMock()
-                mock_task.update_progress = MagicMock()
-                
-                file_path = export_to_xml(sample_data, "test_export", "job123", mock_task)
-                
-                assert file_path.endswith(".xml.gz")
-                assert os.path.exists(file_path)
-                
-                with gzip.open(file_path, 'rt') as f:
-                    content = f.read()
-                    root = ET.fromstring(content)
-                    assert root.tag == "smart_meter_export"
-                    readings = root.find("readings")
-                    assert len(readings.findall("reading")) == 2
+    @pytest.fixture
+    def sample_batch(self, sample_data):
+        return {key: np.array([row[key] for row in sample_data]) for key in sample_data[0]}
+    
+    def test_export_to_csv(self, sample_batch):
+        buffer = io.BytesIO()
+        task = stub_task()
+        
+        file_path, record_count = export_to_csv(
+            [sample_batch], 2, "test_export", "job123", task, buffer
+        )
+        
+        assert record_count == 2
+        assert file_path.endswith("test_export.csv.gz")
+        
+        rows = list(csv.DictReader(io.StringIO(gunzip(buffer))))
+        assert len(rows) == 2
+        assert rows[0]["smart_meter_id"] == "123"
+        assert float(rows[0]["energy_kwh"]) == 0.5
+    
+    def test_export_to_csv_arrow(self, sample_batch):
+        buffer = io.BytesIO()
+        task = stub_task()
+        
+        file_path, record_count = export_to_csv_arrow(
+            [sample_batch], 2, "test_export", "job123", task, buffer
+        )
+        
+        assert record_count == 2
+        assert file_path.endswith("test_export.csv.gz")
+        
+        rows = list(csv.DictReader(io.StringIO(gunzip(buffer))))
+        assert len(rows) == 2
+        assert rows[0]["timestamp"] == "2024-01-01T00:00:00Z"
+        assert rows[0]["smart_meter_id"] == "123"
+        assert float(rows[1]["energy_kwh"]) == 0.6
+    
+    @pytest.mark.skipif(export_pa is None, reason="pyarrow is not installed")
+    def test_csv_writers_parse_identically(self):
+        rng = np.random.default_rng(0)
+        edge_values = [2.0, 230.0, -0.0, 5e-324, 1e-5, 1.5e-7, 1e16, 9999999999999998.0, 0.1 + 0.2]
+        n = 1000 + len(edge_values)
+        floats = np.concatenate([rng.uniform(-300, 300, 1000), edge_values])
+        batch = {
+            "timestamp": np.full(n, "2024-01-01T00:00:00.000Z"),
+            "smart_meter_id": np.full(n, '1,"a"'),
+            "energy_kwh": floats,
+            "power_kw": rng.permutation(floats),
+            "voltage_v": np.exp(rng.uniform(-700, 700, n)),
+            "current_a": rng.uniform(0, 1e-4, n)
+        }
+        outputs = []
+        for writer in (export_to_csv, export_to_csv_arrow):
+            buffer = io.BytesIO()
+            writer([batch], n, "test_export", "job123", stub_task(), buffer)
+            outputs.append(gunzip(buffer))
+        
+        # Only float formatting differs ("2.0" vs "2"); values must round-trip
+        csv_rows, arrow_rows = (
+            list(csv.reader(io.StringIO(output, newline=''), quoting=csv.QUOTE_NONNUMERIC))
+            for output in outputs
+        )
+        assert outputs[0].split("\n", 1)[0] == outputs[1].split("\n", 1)[0]
+        assert csv_rows[0] == list(READING_FIELDS)
+        assert len(csv_rows) == n + 1
+        assert csv_rows == arrow_rows
+        assert csv_rows[1][1] == '1,"a"'
+    
+    @pytest.mark.parametrize("gzip_module", [export_gzip, gzip], ids=["default", "stdlib"])
+    def test_open_export_file_writes_gzip(self, gzip_module, tmp_path):
+        file_path = tmp_path / "test_export.csv.gz"
+        with patch('app.tasks.export_tasks.gzip', gzip_module):
+            with open_export_file(file_path) as f:
+                f.write("timestamp,smart_meter_id\n")
+        
+        with gzip.open(file_path, 'rt') as f:
+            assert f.read() == "timestamp,smart_meter_id\n"
+    
+    def test_export_to_json(self, sample_data, sample_batch):
+        buffer = io.BytesIO()
+        task = stub_task()
+        
+        file_path, record_count = export_to_json(
+            [sample_batch], 2, "test_export", "job123", task, buffer
+        )
+        
+        assert record_count == 2
+        assert file_path.endswith("test_export.json.gz")
+        
+        data = json.loads(gunzip(buffer))
+        assert "metadata" in data
+        assert data["metadata"]["total_records"] == 2
+        assert "data" in data
+        assert data["data"] == sample_data
+    
+    def test_export_to_xml(self, sample_batch):
+        # Only the XML tests need ElementTree (and pyexpat); the app never loads it
+        import xml.etree.ElementTree as ET
+        
+        buffer = io.BytesIO()
+        task = stub_task()
+        
+        file_path, record_count = export_to_xml(
+            [sample_batch], 2, "test_export", "job123", task, buffer
+        )
+        
+        assert record_count == 2
+        assert file_path.endswith("test_export.xml.gz")
+        
+        root = ET.fromstring(gunzip(buffer))
+        assert root.tag == "smart_meter_export"
+        readings = root.find("readings")
+        assert len(readings.findall("reading")) == 2
+
+    def test_export_to_xml_escapes_string_fields(self, sample_batch):
+        import xml.etree.ElementTree as ET
+        
+        sample_batch["smart_meter_id"] = np.array(["1<&>", "1<&>"])
+        buffer = io.BytesIO()
+        
+        export_to_xml([sample_batch], 2, "test_export", "job123", stub_task(), buffer)
+        
+        reading = ET.fromstring(gunzip(buffer)).find("readings/reading")
+        assert reading.findtext("smart_meter_id") == "1<&>"
+        assert reading.findtext("voltage_v") == "230.1"
+
+class TestExportTaskProgress:
+    @pytest.fixture
+    def task(self):
+        with patch('app.tasks.export_tasks.redis_client') as mock_redis:
+            pipe = mock_redis.pipeline.return_value.__enter__.return_value
+            task = ExportTask()
+            task.before_start("task-id", ("job123",), {})
+            yield task, pipe
+    
+    def test_update_progress_writes_to_redis(self, task):
+        task, pipe = task
+        task.update_progress("123e4567-e89b-12d3-a456-426614174000", 10)
+        
+        key = "job:123e4567-e89b-12d3-a456-426614174000:progress"
+        assert pipe.hset.call_args.args[0] == key
+        assert pipe.hset.call_args.kwargs["mapping"]["percentage"] == 10
+        pipe.expire.assert_called_once_with(key, 3600)
+        assert pipe.execute.call_count == 1
+    
+    def test_update_progress_is_throttled(self, task):
+        task, pipe = task
+        task.update_progress("job123", 10)
+        task.update_progress("job123", 11)
+        task.update_progress("job123", 14)
+        assert pipe.execute.call_count == 1
+        
+        task.update_progress("job123", 15)
+        assert pipe.execute.call_count == 2
+        
+        task._last_ts -= 1.0
+        task.update_progress("job123", 16)
+        assert pipe.execute.call_count == 3
+    
+    def test_update_progress_ignores_redis_errors(self, task):
+        task, pipe = task
+        pipe.execute.side_effect = RedisError("connection refused")
+        
+        task.update_progress("job123", 50)
+        assert task._last_pct == 50
+    
+    def test_update_progress_without_before_start(self):
+        with patch('app.tasks.export_tasks.redis_client') as mock_redis:
+            task = ExportTask()
+            task.update_progress("job123", 10)
+        
+        pipe = mock_redis.pipeline.return_value.__enter__.return_value
+        assert pipe.execute.call_count == 1
+
+def executed_updates(session):
+    """Bound values of every UPDATE the mocked session executed, in order."""
+    return [
+        call.args[0].compile().params
+        for call in session.execute.call_args_list
+        if call.args[0].is_update
+    ]
 
+@pytest.mark.xdist_group("tasks")
 class TestProcessExportTask:
     @pytest.fixture
     def mock_db_session(self):
@@ -135,64 +298,85 @@ class TestProcessExportTask:
             mock.return_value.__enter__.return_value = session
             yield session
     
-    def test_process_export_success(self, mock_db_session):
-        job = Job(
-            id="123e4567-e89b-12d3-a456-426614174000",
+    def test_process_export_success(self, mock_db_session, now):
+        job = SimpleNamespace(
             smart_meter_id="123",
-            start_datetime=datetime.now(timezone.utc) - timedelta(hours=1),
-            end_datetime=datetime.now(timezone.utc),
-            status=JobStatus.PENDING,
+            start_datetime=now - timedelta(hours=1),
+            end_datetime=now,
             format="csv"
         )
         
-        mock_db_session.query.return_value.filter.return_value.first.return_value = job
+        mock_db_session.execute.return_value.one_or_none.return_value = job
         
         with patch('app.tasks.export_tasks.settings') as mock_settings:
             mock_settings.export_directory = "/tmp"
             
-            with patch('app.tasks.export_tasks.export_to_csv') as mock_export:
-                mock_export.return_value = "/tmp/test.csv.gz"
+            with patch('app.tasks.export_tasks.export_to_csv_arrow') as mock_export:
+                mock_export.return_value = ("/tmp/test.csv.gz", 61)
                 
                 with patch('os.path.getsize') as mock_size:
                     mock_size.return_value = 1024
                     
-                    mock_self = MagicMock()
-                    mock_self.update_progress = MagicMock()
+                    task = stub_task()
                     
-                    process_export_func(mock_self, str(job.id))
+                    process_export_func(task, "123e4567-e89b-12d3-a456-426614174000")
                     
-                    assert job.status == JobStatus.COMPLETED
-                    assert job.file_path == "/tmp/test.csv.gz"
-                    assert job.file_size_bytes == 1024
-                    assert mock_db_session.commit.called
-    
-    def test_process_export_invalid_meter(self, mock_db_session):
-        job = Job(
-            id="123e4567-e89b-12d3-a456-426614174000",
+                    started, completed = executed_updates(mock_db_session)
+                    assert started["status"] == JobStatus.IN_PROGRESS
+                    assert completed["status"] == JobStatus.COMPLETED
+                    assert completed["file_path"] == "/tmp/test.csv.gz"
+                    assert completed["file_size_bytes"] == 1024
+                    assert completed["record_count"] == 61
+                    assert completed["progress_percentage"] == 100
+                    assert mock_db_session.commit.call_count == 2
+    
+    def test_process_export_csv_without_pyarrow(self, mock_db_session, now):
+        job = SimpleNamespace(
+            smart_meter_id="123",
+            start_datetime=now - timedelta(hours=1),
+            end_datetime=now,
+            format="csv"
+        )
+        
+        mock_db_session.execute.return_value.one_or_none.return_value = job
+        
+        with patch('app.tasks.export_tasks.pa', None), \
+                patch('app.tasks.export_tasks.export_to_csv') as mock_export, \
+                patch('os.path.getsize', return_value=1024):
+            mock_export.return_value = ("/tmp/test.csv.gz", 61)
+            
+            process_export_func(stub_task(), "123e4567-e89b-12d3-a456-426614174000")
+            
+            assert mock_export.called
+            assert executed_updates(mock_db_session)[-1]["status"] == JobStatus.COMPLETED
+    
+    def test_process_export_invalid_meter(self, mock_db_session, now):
+        job = SimpleNamespace(
             smart_meter_id="invalid_meter",
-            start_datetime=datetime.now(timezone.utc) - timedelta(hours=1),
-            end_datetime=datetime.now(timezone.utc),
-            status=JobStatus.PENDING,
+            start_datetime=now - timedelta(hours=1),
+            end_datetime=now,
             format="csv"
         )
         
-        mock_db_session.query.return_value.filter.return_value.first.return_value = job
+        mock_db_session.execute.return_value.one_or_none.return_value = job
         
-        mock_self = MagicMock()
-        mock_self.update_progress = MagicMock()
+        task = stub_task()
         
         with pytest.raises(ValueError) as exc_info:
-            process_export_func(mock_self, str(job.id))
+            process_export_func(task, "123e4567-e89b-12d3-a456-426614174000")
         
         assert "not found" in str(exc_info.value)
-        assert job.status == JobStatus.FAILED
-        assert job.error_code == "SMART_METER_NOT_FOUND"
+        failed = executed_updates(mock_db_session)[-1]
+        assert failed["status"] == JobStatus.FAILED
+        assert failed["error_code"] == "SMART_METER_NOT_FOUND"
+        assert mock_db_session.rollback.called
         assert mock_db_session.commit.called
     
     def test_process_export_job_not_found(self, mock_db_session):
-        mock_db_session.query.return_value.filter.return_value.first.return_value = None
+        mock_db_session.execute.return_value.one_or_none.return_value = None
         
-        mock_self = MagicMock()
+        task = stub_task()
         
-        result = process_export_func(mock_self, "nonexistent-job-id")
-        assert result is None 
\ No newline at end of file
+        result = process_export_func(task, "nonexistent-job-id")
+        assert result is None
+        assert executed_updates(mock_db_session) == []